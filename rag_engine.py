@@ -0,0 +1,241 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+from openai import OpenAI
+from sentence_transformers import SentenceTransformer
+
+# 配置参数
+MODEL_PATH = '/mnt/bit/wxc/projects/zhongche-llm/bge-m3'
+RERANK_MODEL = "/mnt/bit/wxc/projects/zhongche-llm/Qwen3-Reranker-8B"
+RERANKER_BASE_URL = "http://localhost:8002/v1"
+EMBEDDINGS_PATH = "/mnt/bit/wxc/projects/zhongche-llm/embeddings/all_embeddings_bgem3.npz"
+DATA_PATH = "/mnt/bit/wxc/projects/zhongche-llm/data/train_data_all.json"
+
+TOP_K = 5                    # 粗排候选数
+VECTOR_THRESHOLD = 0.40      # 粗排门槛
+COLBERT_THRESHOLD = 0.80     # ColBERT 强校验门槛
+RERANK_THRESHOLD = 0.85      # 精排得分门槛
+RERANK_PASS_THRESHOLD = 0.95 # ColBERT 区分度不足时，精排放行门槛
+COLBERT_GAP_THRESHOLD = 0.04 # ColBERT 区分度门槛 (0.04~0.05 通常足够拉开差距)
+
+
+def _elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def colbert_score(q_reps, d_reps):
+    """基于逐 Token Embedding 手动归一化的细粒度交互校验 (MaxSim)"""
+    # 手动 L2 归一化
+    q_reps = torch.nn.functional.normalize(q_reps, p=2, dim=-1)
+    d_reps = torch.nn.functional.normalize(d_reps, p=2, dim=-1)
+
+    # 计算 MaxSim
+    sim_matrix = torch.matmul(q_reps, d_reps.T)
+    max_sim_per_token, _ = torch.max(sim_matrix, dim=1)
+    return torch.mean(max_sim_per_token).item()
+
+
+class RetrievalEngine:
+    """三关过滤检索引擎：持有 BGE-M3 模型、向量库和原始文档。
+
+    rag_service.py（HTTP 服务）、rag-v2.py 以及离线评测都直接复用同一个实例，
+    检索结果与服务 /retrieve 接口的返回格式一致，并附带各阶段耗时（毫秒）。
+    """
+
+    def __init__(self, model_path=MODEL_PATH, embeddings_path=EMBEDDINGS_PATH,
+                 data_path=DATA_PATH, reranker_base_url=RERANKER_BASE_URL,
+                 rerank_model=RERANK_MODEL, device=None):
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.rerank_model = rerank_model
+        self.reranker_client = OpenAI(base_url=reranker_base_url, api_key="none")
+
+        print(f"Loading BGE-M3 on {self.device}...")
+        self.model = SentenceTransformer(model_path, device=self.device)
+
+        print("Loading embeddings...")
+        database = np.load(embeddings_path)
+        self.embeddings = torch.from_numpy(database["key_b"]).to(self.device)
+
+        print("Loading data...")
+        with open(data_path, "r", encoding="utf-8") as f:
+            self.data = json.load(f)
+
+    def retrieve(self, query):
+        """检索单条查询，返回结果字典（含 timings）"""
+        return self.retrieve_many([query])[0]
+
+    def retrieve_many(self, queries, batch_size=32):
+        """批量检索。向量编码、粗排与 ColBERT 校验按批执行，批内耗时按查询数均摊。"""
+        results = []
+        for start in range(0, len(queries), batch_size):
+            results.extend(self._retrieve_batch(list(queries[start:start + batch_size])))
+        return results
+
+    def _retrieve_batch(self, queries):
+        n = len(queries)
+
+        with torch.no_grad():
+            # 粗排部分
+            t0 = time.perf_counter()
+            query_embeds = self.model.encode(
+                sentences=queries, batch_size=n, convert_to_tensor=True, normalize_embeddings=True
+            ).to(self.embeddings.dtype)
+            embed_ms = _elapsed_ms(t0) / n
+
+            t0 = time.perf_counter()
+            similarities = torch.matmul(query_embeds, self.embeddings.T)
+            values, indices = torch.topk(similarities, k=min(TOP_K, similarities.shape[1]), dim=1)
+            values, indices = values.tolist(), indices.tolist()
+            vector_ms = _elapsed_ms(t0) / n
+
+            # ColBERT 校验只需要通过第一关的查询的 Top1/Top2
+            t0 = time.perf_counter()
+            passed = [i for i in range(n) if values[i][0] >= VECTOR_THRESHOLD]
+            colbert_scores = dict(zip(passed, self._colbert_top2(
+                [queries[i] for i in passed],
+                [[self.data[idx]['instruction'] for idx in indices[i][:2]] for i in passed],
+            )))
+            colbert_ms = _elapsed_ms(t0) / n
+
+        results = []
+        for i, query in enumerate(queries):
+            t0 = time.perf_counter()
+            raw_indices = indices[i]
+            raw_answers = [self.data[idx]['instruction'] for idx in raw_indices]
+            final_idx, status_msg = self._filter(
+                query, raw_answers, raw_indices, values[i][0], colbert_scores.get(i)
+            )
+            rerank_ms = _elapsed_ms(t0)
+
+            timings = {
+                "embed": embed_ms,
+                "vector": vector_ms,
+                "colbert": colbert_ms,
+                "rerank": rerank_ms,
+            }
+            timings["total"] = sum(timings.values())
+            results.append(self._build_result(final_idx, values[i][0], status_msg, timings))
+        return results
+
+    def _colbert_top2(self, queries, top2_answers):
+        """批量计算 ColBERT 分数，每条查询返回 (top1 分数, top2 分数)"""
+        if not queries:
+            return []
+        docs = [answer for answers in top2_answers for answer in answers]
+        q_reps = self.model.encode(queries, output_value='token_embeddings')
+        d_reps = self.model.encode(docs, output_value='token_embeddings')
+
+        scores = []
+        pos = 0
+        for q, answers in zip(q_reps, top2_answers):
+            scores.append(tuple(colbert_score(q, d) for d in d_reps[pos:pos + len(answers)]))
+            pos += len(answers)
+        return scores
+
+    def _filter(self, query, raw_answers, raw_indices, max_vector_score, c_scores):
+        """三关过滤逻辑，返回 (命中的文档下标或 None, 状态说明)"""
+        # --- 第一关：粗排向量检查 ---
+        if max_vector_score < VECTOR_THRESHOLD:
+            return None, "第一关未通过：语义相关度太低。"
+
+        # --- 第二关：ColBERT 区分度校验 ---
+        c_score_top1, c_score_top2 = c_scores
+        c_gap = c_score_top1 - c_score_top2
+
+        print(f"ColBERT 校验: Top1={c_score_top1:.4f}, Gap={c_gap:.4f}")
+
+        if c_score_top1 < COLBERT_THRESHOLD:
+            return None, f"第二关未通过：词级匹配度不足 ({c_score_top1:.4f})。"
+
+        # --- 第三关：Reranker 逻辑 ---
+        refined_query = (
+            "Task: Rigorously evaluate the semantic match between the User Query and the Document.\n"
+            f"User Query: {query}"
+        )
+
+        try:
+            response = self.reranker_client.post(
+                "/rerank",
+                body={
+                    "model": self.rerank_model,
+                    "query": refined_query,
+                    "documents": raw_answers,
+                    "top_n": TOP_K,
+                },
+                cast_to=list
+            )
+            # 获取 Reranker 的结果字典，以 index 为 key，拿到精排给原 Top1 打的分数
+            rerank_map = {res['index']: res['relevance_score'] for res in response['results']}
+            top1_original_score = rerank_map.get(0, 0)
+
+        except Exception as e:
+            return None, f"精排服务异常: {str(e)}"
+
+        print(f"精排对原 Top1 的打分: {top1_original_score:.4f}")
+
+        # 逻辑判定：
+        # 如果 ColBERT 觉得 Top 1 已经很完美了（高分且有 Gap），
+        # 只要精排分数不离谱（达到阈值），我们就坚持选原 Top 1。
+        if c_gap >= COLBERT_GAP_THRESHOLD:
+            if top1_original_score >= RERANK_THRESHOLD:
+                return raw_indices[0], "匹配成功（ColBERT 高置信度确认）"
+            return None, f"精排否定了 ColBERT 的结果 (Score: {top1_original_score:.4f})"
+
+        # 如果 ColBERT 觉得 Top 1 和 Top 2 差不多 (Gap 小)，只有精排给出极高分才放行
+        top1_res = response['results'][0]
+        if top1_res['relevance_score'] >= RERANK_PASS_THRESHOLD:
+            return raw_indices[top1_res['index']], "匹配成功（精排高分放行）"
+
+        return None, f"区分度不足：ColBERT Gap ({c_gap:.4f}) 过小。"
+
+    def _build_result(self, final_idx, score, status_msg, timings):
+        if final_idx is None:
+            # 未找到匹配内容
+            return {
+                "document": "",
+                "title": "",
+                "score": float(score),
+                "id": "",
+                "matched": False,
+                "status": status_msg,
+                "timings": timings,
+            }
+        # 找到匹配内容
+        return {
+            "document": self.data[final_idx]['output'],
+            "title": self.data[final_idx].get('instruction', 'Document'),
+            "score": float(score),
+            "id": str(final_idx),
+            "matched": True,
+            "status": status_msg,
+            "timings": timings,
+        }
+
+
+if __name__ == "__main__":
+    # 离线评测：进程内批量检索，不经过 HTTP 服务
+    parser = argparse.ArgumentParser(description="Run retrieval over a question file in-process.")
+    parser.add_argument("input", help="问题文件，每行一个问题")
+    parser.add_argument("-o", "--output", default="retrieval_output.json")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    engine = RetrievalEngine()
+    start = time.perf_counter()
+    results = engine.retrieve_many(questions, batch_size=args.batch_size)
+    total_ms = _elapsed_ms(start)
+
+    for question, result in zip(questions, results):
+        result["question"] = question
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    matched = sum(result["matched"] for result in results)
+    print(f"Processed {len(results)} questions in {total_ms:.1f} ms, matched {matched}.")
+    print(f"Results saved to {args.output}")